@@ -1,16 +1,256 @@
 # Modern LLM Chat Application with Gradio UI
 import gradio as gr
-import requests
-import validators
-import json
+import asyncio
+import contextlib
+import random
+import threading
+import orjson
 import time
-from typing import Dict, Any, Tuple, Optional
+import functools
+import hashlib
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Any, AsyncIterator, Awaitable, List, Tuple, Optional
+
+if TYPE_CHECKING:
+    import httpx
+
+# Retry policy for transient server errors: exponential backoff with jitter
+_MAX_RETRIES = 3
+_BACKOFF_FACTOR = 0.5
+_BACKOFF_JITTER = 0.3
+_MAX_RETRY_AFTER = 30  # Longest server-requested wait honoured, in seconds
+_RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+_BASE_HEADERS = {"Content-Type": "application/json"}
+
+# Error messages returned by query_model; dynamic details are appended to the prefixes
+_URL_ERR_PREFIX = "Error with base_url: "
+_TEMPERATURE_ERR_PREFIX = "Error with temperature: "
+_MAX_TOKENS_ERR_PREFIX = "Error with max_tokens: "
+_HTTP_ERR_PREFIX = "HTTP error occurred: "
+_UNEXPECTED_ERR_PREFIX = "An unexpected error occurred: "
+_ERR_EMPTY_MODEL = "Error: Model name cannot be empty."
+_ERR_EMPTY_PROMPT = "Error: User prompt cannot be empty."
+_ERR_NO_CHOICES = "Unexpected API response format. Could not find 'choices' in the response."
+_ERR_NO_CONTENT = "Unexpected API response format. Could not find 'message.content' in the response."
+_ERR_TIMEOUT = "Request timed out. The server took too long to respond."
+_ERR_CONNECTION = "Connection error. Could not connect to the server."
+_ERR_INVALID_JSON = "Could not parse the API response as JSON."
+
+# Heavy third-party modules are imported on first use to keep startup fast
+_lazy: Dict[str, Any] = {}
+
+def _get_client() -> "httpx.AsyncClient":
+    """Return the shared async HTTP client, importing httpx and creating it on first use."""
+    client = _lazy.get("client")
+    if client is None:
+        import httpx
+        # Shared async HTTP client so connections are pooled and reused across requests
+        client = _lazy["client"] = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100),
+                retries=_MAX_RETRIES  # Retries failed connection attempts
+            ),
+            timeout=httpx.Timeout(connect=10, read=30, write=10, pool=5),
+        )
+    return client
+
+@contextlib.asynccontextmanager
+async def _post_stream(url: str, headers: Dict[str, str], body: bytes):
+    """Open a streaming POST, retrying transient error statuses with jittered backoff."""
+    for attempt in range(_MAX_RETRIES + 1):
+        async with _get_client().stream("POST", url, headers=headers, content=body) as response:
+            if response.status_code not in _RETRY_STATUSES or attempt == _MAX_RETRIES:
+                yield response
+                return
+            retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            delay = min(float(retry_after), _MAX_RETRY_AFTER)
+        else:
+            delay = _BACKOFF_FACTOR * 2 ** attempt + random.uniform(0, _BACKOFF_JITTER)
+        await asyncio.sleep(delay)
+
+class LLMCache:
+    """LRU cache of model responses, optionally persisted to disk with diskcache."""
+
+    def __init__(self, maxsize: int = 512, directory: Optional[str] = None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._disk = None
+        if directory:
+            try:
+                import diskcache
+                self._disk = diskcache.Cache(directory)
+            except ImportError:
+                print("diskcache is not installed; using the in-memory cache only.")
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None on a miss."""
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        elif self._disk is not None:
+            value = self._disk.get(key)
+            if value is not None:
+                self._remember(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        """Store a response, evicting the least recently used entry when full."""
+        self._remember(key, value)
+        if self._disk is not None:
+            self._disk.set(key, value)
+
+    def _remember(self, key: str, value: str) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats_markdown(self) -> str:
+        """Summarize cache effectiveness for display in the UI."""
+        return f"Cache hits: {self.hits} | Cache misses: {self.misses}"
+
+def cache_key(base_url: str, model: str, messages: List[Dict[str, str]],
+              temperature: float, max_tokens: int) -> Optional[str]:
+    """
+    Build a cache key for a request.
+    
+    Only deterministic (temperature 0) requests are cacheable; None is returned otherwise.
+    """
+    if temperature != 0:
+        return None
+    canonical = orjson.dumps({
+        "base_url": base_url,
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(canonical).hexdigest()
+
+# Response cache shared by all sessions; set LLM_CACHE_DIR to persist it across restarts
+response_cache = LLMCache(directory=os.environ.get("LLM_CACHE_DIR"))
+
+class SemanticCache:
+    """
+    Cache that answers prompts worded differently from, but meaning the same as, earlier ones.
+    
+    User prompts are embedded with a small local sentence-transformers model. Embeddings are
+    L2-normalized on insert so one matrix product scores a prompt against every stored entry
+    by cosine similarity. numpy and sentence-transformers are only imported on first use.
+    """
+
+    MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+    def __init__(self, maxsize: int = 1024, threshold: float = 0.92):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._encoder = None
+        self._load_error: Optional[Exception] = None
+        self._load_lock = threading.Lock()
+        self._size = 0
+        self._clock = 0
+
+    def _load(self) -> None:
+        with self._load_lock:
+            if self._encoder is not None:
+                return
+            # A failed load (e.g. no network to download the model) is not retried
+            if self._load_error is not None:
+                raise self._load_error
+            try:
+                import numpy as np
+                from sentence_transformers import SentenceTransformer
+                encoder = SentenceTransformer(self.MODEL_NAME)
+            except Exception as e:
+                self._load_error = e
+                raise
+            dim = encoder.get_sentence_embedding_dimension()
+            self._matrix = np.zeros((self.maxsize, dim), dtype=np.float32)
+            self._scopes = np.empty(self.maxsize, dtype=object)
+            self._last_used = np.zeros(self.maxsize, dtype=np.int64)
+            self._responses: List[Optional[str]] = [None] * self.maxsize
+            self._encoder = encoder
+
+    def embed(self, text: str):
+        """Return the normalized embedding of text. CPU-bound, so call it off the event loop."""
+        if self._encoder is None:
+            self._load()
+        return self._encoder.encode(text, normalize_embeddings=True).astype("float32")
+
+    def get(self, scope: str, embedding) -> Optional[str]:
+        """Return the response of the most similar prompt within scope, or None below the threshold."""
+        n = self._size
+        if n:
+            scores = self._matrix[:n] @ embedding
+            scores[self._scopes[:n] != scope] = -1.0
+            best = int(scores.argmax())
+            if scores[best] >= self.threshold:
+                self._clock += 1
+                self._last_used[best] = self._clock
+                self.hits += 1
+                return self._responses[best]
+        self.misses += 1
+        return None
+
+    def set(self, scope: str, embedding, response: str) -> None:
+        """Store a response, replacing the least recently used entry when full."""
+        if self._size < self.maxsize:
+            row = self._size
+            self._size += 1
+        else:
+            row = int(self._last_used.argmin())
+        self._matrix[row] = embedding
+        self._scopes[row] = scope
+        self._responses[row] = response
+        self._clock += 1
+        self._last_used[row] = self._clock
+
+    def stats_markdown(self) -> str:
+        """Summarize cache effectiveness for display in the UI."""
+        return f"Semantic hits: {self.hits} | Semantic misses: {self.misses}"
+
+def semantic_scope(base_url: str, model: str, system_prompt: str, max_tokens: int) -> str:
+    """Identify the request settings a semantically cached response is valid for."""
+    return hashlib.sha256(orjson.dumps([base_url, model, system_prompt, max_tokens])).hexdigest()
+
+# Futures of the cacheable requests currently in flight, keyed by cache_key
+_inflight: Dict[str, "asyncio.Future[Tuple[bool, str]]"] = {}
+
+# Semantic cache shared by all sessions, enabled per request from the UI
+semantic_cache = SemanticCache()
+
+def cache_stats_markdown() -> str:
+    """Summarize both response caches for display in the UI."""
+    return f"{response_cache.stats_markdown()} | {semantic_cache.stats_markdown()}"
+
+# URL validation is repeated on every submit with the same URL, so memoize it
+@functools.lru_cache(maxsize=128)
+def _validate_url_cached(url: str) -> bool:
+    """Check a URL with validators, which is only imported on the first call."""
+    validators_url = _lazy.get("validators_url")
+    if validators_url is None:
+        from validators import url as validators_url
+        _lazy["validators_url"] = validators_url
+    return bool(validators_url(url))
 
 def validate_url(url: str) -> Tuple[bool, str]:
     """Validate a URL."""
     if not url:
         return False, "URL cannot be empty."
-    if not validators.url(url):
+    if not _validate_url_cached(url):
         return False, "Invalid URL format."
     return True, ""
 
@@ -30,41 +270,116 @@ def validate_max_tokens(max_tokens: int) -> Tuple[bool, str]:
         return False, "Max tokens must be <= 32000."
     return True, ""
 
-def query_model(base_url: str, model: str, system_prompt: str, user_prompt: str, 
-               temperature: float = 0.7, max_tokens: int = 2000) -> Tuple[bool, str]:
-    """
-    Query an LLM model via API with error handling.
-    
-    Returns:
-        Tuple[bool, str]: (success, response_text)
-            - success: Whether the query was successful
-            - response_text: The response or error message
-    """
+def _validate_inputs(base_url: str, model: str, user_prompt: str, temperature: float, max_tokens: int) -> Optional[str]:
+    """Run every input check and return the first error message, or None if all pass."""
     # Validate base_url
     is_valid, message = validate_url(base_url)
     if not is_valid:
-        return False, f"Error with base_url: {message}"
+        return _URL_ERR_PREFIX + message
     
     # Validate model
     if not model.strip():
-        return False, "Error: Model name cannot be empty."
+        return _ERR_EMPTY_MODEL
     
     # Validate prompts
     if not user_prompt.strip():
-        return False, "Error: User prompt cannot be empty."
+        return _ERR_EMPTY_PROMPT
     
     # Validate temperature
     is_valid, message = validate_temperature(temperature)
     if not is_valid:
-        return False, f"Error with temperature: {message}"
+        return _TEMPERATURE_ERR_PREFIX + message
     
     # Validate max_tokens
     is_valid, message = validate_max_tokens(max_tokens)
     if not is_valid:
-        return False, f"Error with max_tokens: {message}"
+        return _MAX_TOKENS_ERR_PREFIX + message
+    
+    return None
+
+async def _stream_request(base_url: str, headers: Dict[str, str],
+                          payload: Dict[str, Any]) -> AsyncIterator[Tuple[bool, str]]:
+    """
+    Send a chat completion request and stream the response text as it arrives.
+    
+    Yields the same (success, response_text) updates as stream_model, without any caching.
+    """
+    import httpx  # Imported lazily like the client; needed for its exception types
+    
+    try:
+        # Stream the API request through the shared client, retrying transient errors
+        body = orjson.dumps(payload)
+        async with _post_stream(base_url, headers, body) as response:
+            # Check for HTTP errors
+            response.raise_for_status()
+            
+            if response.headers.get("content-type", "").startswith("text/event-stream"):
+                # Accumulate server-sent event deltas, yielding the text so far as each arrives
+                result = None
+                content = ""
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    data = line[6:]
+                    if data == "[DONE]":
+                        break
+                    chunk = orjson.loads(data)
+                    if "error" in chunk:
+                        yield False, f"API error: {chunk['error']}"
+                        return
+                    choices = chunk.get("choices")
+                    delta = choices[0].get("delta", {}).get("content") if choices else None
+                    if delta:
+                        content += delta
+                        yield True, content
+            else:
+                # The server ignored "stream"; parse the JSON response
+                result = orjson.loads(await response.aread())
+        
+        # Extract the content from a non-streamed response
+        if result is not None:
+            choices = result.get("choices")
+            if not choices:
+                yield False, _ERR_NO_CHOICES
+                return
+            content = choices[0].get("message", {}).get("content")
+            if content is None:
+                yield False, _ERR_NO_CONTENT
+                return
+        
+        yield True, content
+            
+    except httpx.TimeoutException:
+        yield False, _ERR_TIMEOUT
+    except httpx.ConnectError:
+        yield False, _ERR_CONNECTION
+    except httpx.HTTPStatusError as e:
+        yield False, _HTTP_ERR_PREFIX + str(e)
+    except orjson.JSONDecodeError:
+        yield False, _ERR_INVALID_JSON
+    except Exception as e:
+        yield False, _UNEXPECTED_ERR_PREFIX + str(e)
+
+async def stream_model(base_url: str, model: str, system_prompt: str, user_prompt: str, 
+                temperature: float = 0.7, max_tokens: int = 2000,
+                use_semantic_cache: bool = False) -> AsyncIterator[Tuple[bool, str]]:
+    """
+    Query an LLM model via API with error handling, streaming the response as it is generated.
+    
+    Yields:
+        Tuple[bool, str]: (success, response_text)
+            - success: Whether the query has succeeded so far
+            - response_text: The response text received so far, or an error message
+        The last item yielded is the final result.
+    """
+    # Validate inputs
+    error = _validate_inputs(base_url, model, user_prompt, temperature, max_tokens)
+    if error:
+        yield False, error
+        return
     
     # Prepare the request
-    headers = {"Content-Type": "application/json"}
+    headers = _BASE_HEADERS
     payload = {
         "model": model,
         "messages": [
@@ -72,57 +387,110 @@ def query_model(base_url: str, model: str, system_prompt: str, user_prompt: str,
             {"role": "user", "content": user_prompt}
         ],
         "temperature": temperature,
-        "max_tokens": max_tokens
+        "max_tokens": max_tokens,
+        "stream": True
     }
     
+    # Serve deterministic repeats from the cache without touching the network
+    key = cache_key(base_url, model, payload["messages"], temperature, max_tokens)
+    if key is not None:
+        cached = response_cache.get(key)
+        if cached is not None:
+            yield True, cached
+            return
+    
+    # Then look for an earlier answer to a reworded prompt, if enabled
+    embedding = None
+    if use_semantic_cache:
+        scope = semantic_scope(base_url, model, system_prompt, max_tokens)
+        try:
+            embedding = await asyncio.to_thread(semantic_cache.embed, user_prompt)
+        except ImportError:
+            yield False, "The semantic cache requires the numpy and sentence-transformers packages."
+            return
+        except Exception as e:
+            yield False, f"The semantic cache is unavailable: {e}"
+            return
+        cached = semantic_cache.get(scope, embedding)
+        if cached is not None:
+            yield True, cached
+            return
+    
+    # Join an identical request already in flight instead of sending it again
+    inflight = None
+    if key is not None:
+        inflight = _inflight.get(key)
+        if inflight is not None:
+            yield await asyncio.shield(inflight)
+            return
+        inflight = _inflight[key] = asyncio.get_running_loop().create_future()
+    
+    result = False, "No response received."
+    completed = False
     try:
-        # Make the API request with a timeout
-        response = requests.post(base_url, headers=headers, json=payload, timeout=30)
-        
-        # Check for HTTP errors
-        response.raise_for_status()
-        
-        # Parse the JSON response
-        result = response.json()
-        
-        # Extract the content from the response
-        if "choices" in result and len(result["choices"]) > 0:
-            if "message" in result["choices"][0] and "content" in result["choices"][0]["message"]:
-                content = result["choices"][0]["message"]["content"]
-                return True, content
-            else:
-                error_msg = "Unexpected API response format. Could not find 'message.content' in the response."
-                return False, error_msg
-        else:
-            error_msg = "Unexpected API response format. Could not find 'choices' in the response."
-            return False, error_msg
-            
-    except requests.exceptions.Timeout:
-        error_msg = "Request timed out. The server took too long to respond."
-        return False, error_msg
-    except requests.exceptions.ConnectionError:
-        error_msg = "Connection error. Could not connect to the server."
-        return False, error_msg
-    except requests.exceptions.HTTPError as e:
-        error_msg = f"HTTP error occurred: {str(e)}"
-        return False, error_msg
-    except json.JSONDecodeError:
-        error_msg = "Could not parse the API response as JSON."
-        return False, error_msg
-    except Exception as e:
-        error_msg = f"An unexpected error occurred: {str(e)}"
-        return False, error_msg
+        async for result in _stream_request(base_url, headers, payload):
+            if not result[0]:
+                break  # Failures are final; settle joined requests before reporting this one
+            yield result
+        completed = True
+    finally:
+        if inflight is not None:
+            del _inflight[key]
+            if not completed:
+                result = False, "The identical request this one joined was cancelled."
+            inflight.set_result(result)
+    
+    success, content = result
+    if not success:
+        yield result
+    else:
+        if key is not None:
+            response_cache.set(key, content)
+        if embedding is not None:
+            semantic_cache.set(scope, embedding, content)
 
-def process_chat(base_url: str, model: str, system_prompt: str, user_prompt: str, 
-                temperature: float, max_tokens: int) -> Tuple[str, str, str]:
+async def query_model(base_url: str, model: str, system_prompt: str, user_prompt: str, 
+               temperature: float = 0.7, max_tokens: int = 2000,
+               use_semantic_cache: bool = False) -> Tuple[bool, str]:
     """
-    Process the chat inputs and return the results.
+    Query an LLM model via API with error handling, waiting for the complete response.
     
     Returns:
-        Tuple[str, str, str]: (response_markdown, input_text, output_text)
+        Tuple[bool, str]: (success, response_text)
+            - success: Whether the query was successful
+            - response_text: The response or error message
     """
-    # Format input for clipboard
-    input_text = f"""Base URL: {base_url}
+    result = False, "No response received."
+    async for result in stream_model(base_url, model, system_prompt, user_prompt,
+                                    temperature, max_tokens, use_semantic_cache):
+        pass
+    return result
+
+async def query_models(base_url: str, models: List[str], system_prompt: str, user_prompt: str,
+                       temperature: float, max_tokens: int, use_semantic_cache: bool = False) -> str:
+    """
+    Query several models concurrently and combine their responses.
+    
+    Wall time is that of the slowest model rather than the sum of all of them.
+    
+    Returns:
+        str: One Markdown section per model, in the order given
+    """
+    results = await asyncio.gather(*(
+        query_model(base_url, m, system_prompt, user_prompt, temperature, max_tokens, use_semantic_cache)
+        for m in models
+    ), return_exceptions=True)
+    
+    sections = []
+    for m, result in zip(models, results):
+        if isinstance(result, BaseException):
+            result = (False, _UNEXPECTED_ERR_PREFIX + str(result))
+        success, text = result
+        sections.append(f"## {m}\n\n{text if success else 'Error: ' + text}")
+    return "\n\n---\n\n".join(sections)
+
+# Clipboard summary of the inputs of a submit
+_INPUT_TEMPLATE = """Base URL: {base_url}
 Model: {model}
 Temperature: {temperature}
 Max Tokens: {max_tokens}
@@ -132,21 +500,75 @@ System Prompt:
 
 User Prompt:
 {user_prompt}"""
+
+@dataclass(slots=True)
+class ChatResult:
+    """The outcome of one submit, kept in a single gr.State for the copy buttons."""
+    display: str
+    raw: str
+    input_text: str
+
+async def _as_updates(response: Awaitable[str]) -> AsyncIterator[Tuple[bool, str]]:
+    """Adapt a compare-mode result to the (success, response_text) updates of stream_model."""
+    yield True, await response
+
+async def process_chat(base_url: str, model: str, system_prompt: str, user_prompt: str, 
+                temperature: float, max_tokens: int, compare_models: str = "",
+                use_semantic_cache: bool = False, last_key: Optional[int] = None,
+                last_result: Optional[ChatResult] = None) -> AsyncIterator[Tuple[str, ChatResult, Optional[int]]]:
+    """
+    Process the chat inputs and stream the results.
     
-    # Query the model
-    success, response_text = query_model(
-        base_url, model, system_prompt, user_prompt, temperature, max_tokens
-    )
+    Yields:
+        Tuple[str, ChatResult, Optional[int]]: (response_markdown, result, input_key), updated as
+            tokens arrive. input_key is only set on the final yield of a successful response.
+    """
+    # Format input for clipboard
+    input_text = _INPUT_TEMPLATE.format_map({
+        "base_url": base_url,
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "system_prompt": system_prompt,
+        "user_prompt": user_prompt
+    })
     
-    if not success:
-        # Return the error message formatted as markdown
-        error_markdown = f"""## Error
+    # Resubmitting unchanged inputs replays the last response without querying again
+    key = hash((base_url, model, system_prompt, user_prompt, temperature, max_tokens,
+                compare_models, use_semantic_cache))
+    if key == last_key and last_result is not None:
+        yield last_result.display, last_result, key
+        return
+    
+    # Query every listed model concurrently in compare mode; a single listed model replaces the
+    # Model field, otherwise stream the Model field's model
+    models = [m.strip() for m in compare_models.split(",") if m.strip()]
+    if len(models) > 1:
+        updates = _as_updates(query_models(
+            base_url, models, system_prompt, user_prompt, temperature, max_tokens, use_semantic_cache
+        ))
+    else:
+        updates = stream_model(
+            base_url, models[0] if models else model, system_prompt, user_prompt,
+            temperature, max_tokens, use_semantic_cache
+        )
+    
+    async for success, response_text in updates:
+        if not success:
+            await updates.aclose()  # Finish the stream now rather than when it is garbage collected
+            # Yield the error message formatted as markdown
+            error_markdown = f"""## Error
 
 {response_text}"""
-        return error_markdown, input_text, error_markdown
+            yield error_markdown, ChatResult(error_markdown, error_markdown, input_text), None
+            return
+        
+        # Yield the response text (already in markdown format)
+        result = ChatResult(response_text, response_text, input_text)
+        yield response_text, result, None
     
-    # Return the response text (already in markdown format)
-    return response_text, input_text, response_text
+    # Remember the inputs of the completed response
+    yield result.display, result, key
 
 # JavaScript for clipboard functionality
 js_code = """
@@ -217,10 +639,10 @@ with gr.Blocks(css=css, js=js_code, title="LLM Chat Application") as demo:
     </div>
     """)
     
-    # Hidden components for clipboard content
-    input_clipboard = gr.State("")
-    output_clipboard = gr.State("")
-    clipboard_status = gr.State("")
+    # Hidden state holding the last result for the copy buttons
+    chat_state = gr.State(None)
+    # Hash of the inputs behind chat_state, used to skip identical resubmits
+    last_key = gr.State(None)
     
     with gr.Group(elem_classes=["container"]):
         with gr.Accordion("API Configuration", open=True):
@@ -237,6 +659,11 @@ with gr.Blocks(css=css, js=js_code, title="LLM Chat Application") as demo:
                     value="gpt-3.5-turbo",
                     elem_classes=["input-box"]
                 )
+                compare_models = gr.Textbox(
+                    label="Compare Models (comma-separated, optional; a single model replaces Model)",
+                    placeholder="gpt-3.5-turbo, gpt-4o-mini",
+                    elem_classes=["input-box"]
+                )
         
         with gr.Group():
             system_prompt = gr.Textbox(
@@ -270,6 +697,13 @@ with gr.Blocks(css=css, js=js_code, title="LLM Chat Application") as demo:
                         value=2000,
                         precision=0
                     )
+                
+                with gr.Column(scale=1):
+                    use_semantic_cache = gr.Checkbox(
+                        label="Semantic Cache",
+                        info="Reuse answers to similar prompts (loads a local embedding model)",
+                        value=False
+                    )
             
             submit_btn = gr.Button("Submit", variant="primary")
     
@@ -281,12 +715,30 @@ with gr.Blocks(css=css, js=js_code, title="LLM Chat Application") as demo:
             copy_input_btn = gr.Button("Copy Input to Clipboard", elem_classes=["copy-btn"])
             copy_output_btn = gr.Button("Copy Output to Clipboard", elem_classes=["copy-btn"])
             status_display = gr.Textbox(label="", elem_classes=["copy-status"], visible=True)
+        
+        # Hidden text sources for the copy buttons, filled from chat_state after each submit
+        input_clipboard = gr.Textbox(visible=False)
+        output_clipboard = gr.Textbox(visible=False)
+        
+        # Response cache statistics
+        cache_stats = gr.Markdown(cache_stats_markdown())
     
     # Event handlers
     submit_result = submit_btn.click(
         fn=process_chat,
-        inputs=[base_url, model, system_prompt, user_prompt, temperature, max_tokens],
-        outputs=[output, input_clipboard, output_clipboard]
+        inputs=[base_url, model, system_prompt, user_prompt, temperature, max_tokens, compare_models,
+                use_semantic_cache, last_key, chat_state],
+        outputs=[output, chat_state, last_key],
+        concurrency_limit=64  # Async handlers let many generations share the event loop
+    )
+    submit_result.then(
+        fn=cache_stats_markdown,
+        outputs=[cache_stats]
+    )
+    submit_result.then(
+        fn=lambda result: (result.input_text, result.raw) if result else ("", ""),
+        inputs=[chat_state],
+        outputs=[input_clipboard, output_clipboard]
     )
     
     # Copy input to clipboard
@@ -309,4 +761,4 @@ with gr.Blocks(css=css, js=js_code, title="LLM Chat Application") as demo:
 
 # Launch the app
 if __name__ == "__main__":
-    demo.launch()
+    demo.queue(default_concurrency_limit=64, max_size=256).launch()
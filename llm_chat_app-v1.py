@@ -1,22 +1,247 @@
 # LLM Chat Application with Gradio UI
-import requests
-import json
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import functools
+import hashlib
+import httpx
+import importlib.util
+import itertools
+import orjson
+import os
+import threading
 import time
-import gradio as gr
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Final
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis is an optional second cache tier
+    aioredis = None
 
 # Constants for default values
 DEFAULT_BASE_URL = "http://localhost:8000/v1"
 DEFAULT_MODEL = "mistralai/Mistral-Small-3.1-24B-Instruct-2503"
+DEFAULT_SMALL_BASE_URL = "http://localhost:8001/v1"
+DEFAULT_SMALL_MODEL = "meta-llama/Llama-3.2-3B-Instruct"
 DEFAULT_TEMPERATURE = 0.15
-DEFAULT_MAX_TOKENS = 4096
+DEFAULT_MAX_TOKENS = 1024
+DEFAULT_STOP = ["\nUser:", "\nSystem:"]  # Cut off runaway generations that start a new turn
 MAX_RETRIES = 3
-RETRY_DELAY = 2  # seconds
+RETRY_BACKOFF_FACTOR = 0.5  # seconds, doubled on each retry
+RETRY_MAX_DELAY = 30  # seconds; longer Retry-After values are capped
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("LLM_MAX_CONCURRENCY", "32"))
+MAX_REQUESTS_PER_MINUTE = int(os.environ.get("LLM_MAX_RPM", "500"))
+CACHE_MAX_ENTRIES = 512
+CACHE_MAX_TEMPERATURE = 0.2  # Above this, completions vary too much to reuse
+CACHE_TTL = 3600  # seconds, for the Redis tier
+SEMANTIC_CACHE_THRESHOLD = 0.93  # Minimum cosine similarity for a semantic hit
+SEMANTIC_CACHE_MAX_TEMPERATURE = 0.3
+HISTORY_MAX_TURNS = 12  # Messages sent verbatim before older ones are summarized
+HISTORY_MAX_TOKENS = 2048
+SUMMARY_PROMPT = "Summarize this conversation in 150 words or fewer, keeping names, facts and decisions."
 
-def get_default_system_prompt():
-    """Generate a default system prompt with current date."""
-    today = datetime.now().strftime("%Y-%m-%d")
-    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+# Custom CSS for styling
+_CSS: Final[str] = """
+.container { max-width: 1200px; margin: auto; }
+.message pre { background-color: #f6f8fa; padding: 10px; border-radius: 4px; overflow-x: auto; }
+.message code { font-family: monospace; background-color: #f6f8fa; padding: 2px 4px; border-radius: 3px; }
+.markdown-area { border: 1px solid #ddd; border-radius: 4px; padding: 10px; }
+"""
+
+# Shared async client so concurrent chats overlap on one event loop over pooled HTTP/2 connections
+_ACLIENT = httpx.AsyncClient(
+    timeout=httpx.Timeout(60.0, connect=5.0),
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=MAX_RETRIES,  # Retry failed connection attempts
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    ),
+)
+
+class RateLimiter:
+    """Token bucket that allows up to rpm requests per minute."""
+    
+    def __init__(self, rpm=500):
+        self.rate = rpm / 60.0  # Tokens added per second
+        self.capacity = float(rpm)
+        self.tokens = float(rpm)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """Wait until a request may be sent, then take its token."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# Client-side limits so concurrent users don't pile onto the backend
+_SEM = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+_LIMITER = RateLimiter(rpm=MAX_REQUESTS_PER_MINUTE)
+
+@contextlib.asynccontextmanager
+async def _post_stream(url, headers, body):
+    """
+    Open a streaming POST, retrying transient error statuses with exponential backoff.
+    
+    At most MAX_CONCURRENT_REQUESTS are in flight at once, and every attempt
+    counts against the MAX_REQUESTS_PER_MINUTE budget. The concurrency slot is
+    released while waiting between attempts.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        async with _SEM:
+            await _LIMITER.acquire()
+            async with _ACLIENT.stream("POST", url, headers=headers, content=body) as response:
+                if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    yield response
+                    return
+                retry_after = response.headers.get("Retry-After", "")
+        # Honour the server's Retry-After when given, otherwise back off exponentially
+        if retry_after.isdigit():
+            delay = min(float(retry_after), RETRY_MAX_DELAY)
+        else:
+            delay = RETRY_BACKOFF_FACTOR * 2 ** attempt
+        await asyncio.sleep(delay)
+
+# Response cache: in-process LRU, backed by Redis when REDIS_URL is set
+_response_cache = OrderedDict()
+_REDIS = aioredis.from_url(os.environ["REDIS_URL"]) if aioredis and os.environ.get("REDIS_URL") else None
+
+def _cache_key(model, messages, temperature, max_tokens, stop):
+    """Hash every request field that determines the completion."""
+    blob = orjson.dumps(
+        {"m": model, "msgs": messages, "t": temperature, "mx": max_tokens, "s": stop},
+        option=orjson.OPT_SORT_KEYS,
+    )
+    return hashlib.blake2b(blob).hexdigest()
+
+def _cache_remember(key, content):
+    """Store a completion in the local LRU, evicting the oldest entry when full."""
+    _response_cache[key] = content
+    _response_cache.move_to_end(key)
+    if len(_response_cache) > CACHE_MAX_ENTRIES:
+        _response_cache.popitem(last=False)
+
+async def _cache_get(key):
+    """Look up a cached completion, promoting Redis hits into the local LRU."""
+    if key in _response_cache:
+        _response_cache.move_to_end(key)
+        return _response_cache[key]
+    if _REDIS is not None:
+        try:
+            cached = await _REDIS.get(key)
+        except Exception:
+            return None  # A cache outage should never fail the query
+        if cached is not None:
+            _cache_remember(key, cached.decode())
+            return cached.decode()
+    return None
+
+async def _cache_set(key, content):
+    """Store a completion in every cache tier."""
+    _cache_remember(key, content)
+    if _REDIS is not None:
+        try:
+            await _REDIS.setex(key, CACHE_TTL, content)
+        except Exception:
+            pass
+
+# Semantic cache: embeddings of past prompts searched with faiss, so paraphrases
+# of an answered question are served too. Used when both libraries are installed.
+# Switched off for the rest of the process if the embedding model fails to load.
+_semantic_enabled = all(
+    importlib.util.find_spec(name) for name in ("sentence_transformers", "faiss")
+)
+_semantic = {}  # Embedding model and index, loaded on first use
+_semantic_entries = OrderedDict()  # faiss id -> (scope, response), oldest first
+_semantic_ids = itertools.count()
+_semantic_lock = threading.Lock()
+
+def _semantic_index():
+    """Load the embedding model and build the faiss index on first use."""
+    global _semantic_enabled
+    if not _semantic:
+        if not _semantic_enabled:
+            raise RuntimeError("The semantic cache is disabled")
+        import faiss
+        import numpy
+        from sentence_transformers import SentenceTransformer
+        
+        try:
+            embedder = SentenceTransformer("all-MiniLM-L6-v2")
+        except Exception:
+            # E.g. an offline host; don't retry the download on every request
+            _semantic_enabled = False
+            raise
+        dimension = embedder.get_sentence_embedding_dimension()
+        _semantic["embedder"] = embedder
+        _semantic["index"] = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        _semantic["numpy"] = numpy
+    return _semantic["embedder"], _semantic["index"]
+
+def _semantic_lookup(scope, text):
+    """
+    Embed a prompt and search for a cached response to a similar one.
+    
+    Prompts longer than the embedder's input window are not looked up, since
+    everything past it would be ignored and different prompts could match.
+    
+    Returns:
+        tuple: (embedding or None if the prompt is too long, cached response or None)
+    """
+    with _semantic_lock:
+        embedder, index = _semantic_index()
+        if len(embedder.tokenizer(text)["input_ids"]) > embedder.max_seq_length:
+            return None, None
+        vector = embedder.encode([text], normalize_embeddings=True)
+        if index.ntotal:
+            scores, ids = index.search(vector, min(8, index.ntotal))
+            for score, entry_id in zip(scores[0], ids[0]):
+                if score < SEMANTIC_CACHE_THRESHOLD:
+                    break
+                entry = _semantic_entries.get(int(entry_id))
+                # Only reuse answers given for the same model and earlier conversation
+                if entry and entry[0] == scope:
+                    _semantic_entries.move_to_end(int(entry_id))
+                    return vector, entry[1]
+        return vector, None
+
+def _semantic_store(scope, vector, response):
+    """Add a response to the semantic cache, evicting the least recently used entry when full."""
+    with _semantic_lock:
+        _, index = _semantic_index()
+        numpy = _semantic["numpy"]
+        entry_id = next(_semantic_ids)
+        index.add_with_ids(vector, numpy.array([entry_id], dtype="int64"))
+        _semantic_entries[entry_id] = (scope, response)
+        if len(_semantic_entries) > CACHE_MAX_ENTRIES:
+            oldest_id, _ = _semantic_entries.popitem(last=False)
+            index.remove_ids(numpy.array([oldest_id], dtype="int64"))
+
+async def _store_completion(cache_key, semantic_key, content):
+    """Record a successful completion in whichever caches the request was eligible for."""
+    if not content:
+        return
+    if cache_key:
+        await _cache_set(cache_key, content)
+    if semantic_key:
+        await asyncio.to_thread(_semantic_store, *semantic_key, content)
+
+@functools.lru_cache(maxsize=2)
+def _build_default_system_prompt(today_ord: int) -> str:
+    """Build the default system prompt for a given day, so its bytes stay identical all day."""
+    today_date = date.fromordinal(today_ord)
+    today = today_date.isoformat()
+    yesterday = (today_date - timedelta(days=1)).isoformat()
     
     return f"""You are an AI assistant powered by a large language model.
 Your knowledge base was last updated in 2023.
@@ -27,17 +252,27 @@ If the user's question is not clear, ambiguous, or does not provide enough conte
 You are always very attentive to dates, in particular you try to resolve dates (e.g. "yesterday" is {yesterday}) and when asked about information at specific dates, you discard information that is at another date. 
 You follow these instructions in all languages, and always respond to the user in the language they use or request."""
 
-def query_llm(
+def get_default_system_prompt():
+    """Generate a default system prompt with current date."""
+    return _build_default_system_prompt(date.today().toordinal())
+
+# Build today's prompt at import so the first request and UI render find it cached
+get_default_system_prompt()
+
+async def query_llm(
     user_prompt, 
     base_url=DEFAULT_BASE_URL, 
     model=DEFAULT_MODEL,
     system_prompt=None, 
     temperature=DEFAULT_TEMPERATURE,
     max_tokens=DEFAULT_MAX_TOKENS,
-    chat_history=None
+    chat_history=None,
+    stop=None,
+    use_semantic_cache=True
 ):
     """
-    Query an LLM model with improved error handling and configurability.
+    Query an LLM model with improved error handling and configurability,
+    streaming the response as it is generated.
     
     Args:
         user_prompt (str): The user prompt to send to the model
@@ -46,17 +281,22 @@ def query_llm(
         system_prompt (str, optional): System prompt to guide model behavior
         temperature (float): Sampling temperature
         max_tokens (int): Maximum number of tokens to generate
-        chat_history (list, optional): List of previous message dicts
+        chat_history (list, optional): Complete list of message dicts, ending with the
+            current user message; when given, user_prompt is not appended again
+        stop (list, optional): Stop sequences; defaults to DEFAULT_STOP
+        use_semantic_cache (bool): Whether paraphrases may be served from the semantic cache
         
-    Returns:
-        tuple: (success (bool), response (dict or str))
+    Yields:
+        tuple: (success (bool), response (str)) where response is the text
+        received so far, or an error message. The last item is the final result.
     """
     try:
         # Convert parameters to appropriate types
         temperature = float(temperature)
         max_tokens = int(max_tokens)
     except (ValueError, TypeError):
-        return False, "Invalid parameters: temperature must be a float and max_tokens must be an integer"
+        yield False, "Invalid parameters: temperature must be a float and max_tokens must be an integer"
+        return
     
     # Default system prompt if none provided
     if not system_prompt:
@@ -71,151 +311,362 @@ def query_llm(
     # Add system message
     messages.append({"role": "system", "content": system_prompt})
     
-    # Add chat history if provided
+    # Add the conversation, which already ends with the current user message
     if chat_history:
         messages.extend(chat_history)
-    
-    # Add the current user message
-    messages.append({"role": "user", "content": user_prompt})
+    else:
+        # Add the current user message
+        messages.append({"role": "user", "content": user_prompt})
     
     # Prepare the request payload
     payload = {
         "model": model,
         "messages": messages,
         "temperature": temperature,
-        "max_tokens": max_tokens
+        "max_tokens": max_tokens,
+        "stream": True
     }
+    if stop is None:
+        stop = DEFAULT_STOP
+    if stop:
+        payload["stop"] = stop
     
     # Headers
     headers = {
-        "Content-Type": "application/json"
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream"
     }
     
-    # Send the request with retries
-    for attempt in range(MAX_RETRIES):
+    # Serve near-deterministic requests from the cache
+    cache_key = None
+    if temperature <= CACHE_MAX_TEMPERATURE:
+        cache_key = _cache_key(model, messages, temperature, max_tokens, stop)
+        cached = await _cache_get(cache_key)
+        if cached is not None:
+            yield True, cached
+            return
+    
+    # Serve paraphrases of earlier prompts from the semantic cache. Only the latest
+    # user message is embedded; everything before it must match exactly.
+    semantic_key = None
+    if use_semantic_cache and _semantic_enabled and temperature < SEMANTIC_CACHE_MAX_TEMPERATURE:
+        history_digest = hashlib.blake2b(orjson.dumps(messages[:-1])).hexdigest()
+        scope = (model, history_digest)
         try:
-            response = requests.post(
-                endpoint, 
-                headers=headers, 
-                data=json.dumps(payload),
-                timeout=60  # Add timeout to prevent hanging
-            )
+            vector, cached = await asyncio.to_thread(_semantic_lookup, scope, messages[-1]["content"])
+        except Exception:
+            vector, cached = None, None  # Fall through to the API if the embedder fails
+        if cached is not None:
+            yield True, cached
+            return
+        if vector is not None:
+            semantic_key = (scope, vector)
+    
+    # Send the request, retrying transient errors, and stream the response
+    try:
+        async with _post_stream(endpoint, headers, orjson.dumps(payload)) as response:
+            if response.status_code != 200:
+                await response.aread()
+                yield False, f"Request failed with status {response.status_code}: {response.text}"
+                return
+            
+            if not response.headers.get("Content-Type", "").startswith("text/event-stream"):
+                # The server ignored "stream" and sent the whole completion at once
+                await response.aread()
+                content = orjson.loads(response.content)["choices"][0]["message"]["content"]
+                await _store_completion(cache_key, semantic_key, content)
+                yield True, content
+                return
             
-            if response.status_code == 200:
-                return True, response.json()
-            else:
-                error_msg = f"Request failed with status {response.status_code}: {response.text}"
-                # If we've reached max retries, return the error
-                if attempt == MAX_RETRIES - 1:
-                    return False, error_msg
-                # Otherwise, wait and retry
-                time.sleep(RETRY_DELAY)
-        except Exception as e:
-            error_msg = f"Error during API call: {str(e)}"
-            # If we've reached max retries, return the error
-            if attempt == MAX_RETRIES - 1:
-                return False, error_msg
-            # Otherwise, wait and retry
-            time.sleep(RETRY_DELAY)
-    
-    # This should not be reached, but just in case
-    return False, "Max retries exceeded with no successful response"
-
-def extract_message_content(chat_history):
+            content = ""
+            async for line in response.aiter_lines():
+                if not line or not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    break
+                chunk = orjson.loads(data)
+                choices = chunk.get("choices")
+                if not choices:
+                    continue
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    content += delta
+                    yield True, content
+            await _store_completion(cache_key, semantic_key, content)
+            yield True, content
+    except (KeyError, IndexError) as e:
+        yield False, f"Error parsing API response: {str(e)}"
+    except Exception as e:
+        yield False, f"Error during API call: {str(e)}"
+
+async def query_llm_batch(
+    user_prompts, 
+    base_url=DEFAULT_BASE_URL, 
+    model=DEFAULT_MODEL,
+    system_prompt=None, 
+    temperature=DEFAULT_TEMPERATURE,
+    max_tokens=DEFAULT_MAX_TOKENS
+):
     """
-    Extract message content from Gradio chat history for API calls.
+    Query an LLM model with several independent prompts at once.
+    
+    The requests are sent concurrently over the shared client, so the server
+    batches them together instead of serving them one after another.
     
     Args:
-        chat_history (list): List of tuples from Gradio chatbot
+        user_prompts (list): The user prompts to send to the model
+        base_url (str): Base URL for the API endpoint
+        model (str): Model identifier to use
+        system_prompt (str, optional): System prompt shared by every prompt
+        temperature (float): Sampling temperature
+        max_tokens (int): Maximum number of tokens to generate per prompt
         
     Returns:
-        list: Messages in the format expected by the API
+        list: (success (bool), response (str)) tuples, in the order of user_prompts
     """
-    messages = []
-    for sender, content in chat_history:
-        # Skip system messages
-        if sender == "System":
-            continue
+    async def final_result(user_prompt):
+        result = (False, "No response received")
+        async for result in query_llm(
+            user_prompt=user_prompt,
+            base_url=base_url,
+            model=model,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_tokens=max_tokens
+        ):
+            pass
+        return result
+    
+    return await asyncio.gather(*(final_result(prompt) for prompt in user_prompts))
+
+async def _trim_history(
+    messages, 
+    max_turns=HISTORY_MAX_TURNS, 
+    max_tokens=HISTORY_MAX_TOKENS,
+    base_url=DEFAULT_BASE_URL,
+    model=DEFAULT_MODEL
+):
+    """
+    Bound the conversation sent with each request.
+    
+    Once the history exceeds either limit, its oldest messages are replaced by a
+    model-written summary. The newest messages that fit in half of each limit are
+    kept verbatim, so the history (and the server's cached prefix) then stays
+    unchanged for several turns before the next compaction. The summary is
+    prepended to the first kept user message, so the roles still alternate
+    starting with the user, as strict chat templates require.
+    
+    Args:
+        messages (list): Message dicts of the conversation so far, ending with
+            the current user message, which is always kept
+        max_turns (int): Maximum number of messages to send verbatim
+        max_tokens (int): Maximum estimated tokens to send verbatim
+        base_url (str): Base URL of the model writing the summary
+        model (str): Model writing the summary
         
-        role = "user" if sender == "User" else "assistant"
-        messages.append({"role": role, "content": content})
+    Returns:
+        list: The messages to send, unchanged if within limits or if summarizing fails
+    """
+    tokens = sum(len(msg["content"]) // 4 for msg in messages)  # Rough token estimate
+    if len(messages) <= max_turns and tokens <= max_tokens:
+        return messages
+    
+    # Keep the newest messages within half of each limit, starting on a user turn
+    keep = 0
+    tokens = 0
+    for msg in reversed(messages):
+        tokens += len(msg["content"]) // 4
+        if keep and (keep >= max_turns // 2 or tokens > max_tokens // 2):
+            break
+        keep += 1
+    while keep and messages[-keep]["role"] != "user":
+        keep -= 1
+    dropped = messages[:len(messages) - keep]
+    kept = messages[len(messages) - keep:]
+    
+    transcript = "\n\n".join(f"{msg['role']}: {msg['content']}" for msg in dropped)
+    summary = None
+    async for success, response in query_llm(
+        user_prompt=f"{SUMMARY_PROMPT}\n\n{transcript}",
+        base_url=base_url,
+        model=model,
+        temperature=0,
+        max_tokens=300,
+        use_semantic_cache=False  # Similar transcripts must not share a summary
+    ):
+        if not success:
+            return messages
+        summary = response
+    
+    first = {"role": "user", "content": f"[Earlier summary]: {summary}\n\n{kept[0]['content']}"}
+    return [first] + kept[1:]
+
+def parse_stop_sequences(stop_text):
+    """
+    Parse stop sequences entered in the UI as a JSON list of strings.
+    
+    Args:
+        stop_text (str): JSON list such as ["\\nUser:"]; empty for no stop sequences
+        
+    Returns:
+        list or None: The stop sequences, or None if the text is not a list of strings
+    """
+    if not stop_text or not stop_text.strip():
+        return []
+    try:
+        stop = orjson.loads(stop_text)
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(stop, list) or not all(isinstance(seq, str) for seq in stop):
+        return None
+    return stop
+
+def pick_model(
+    user_prompt, 
+    chat_history, 
+    base_url=DEFAULT_BASE_URL, 
+    model=DEFAULT_MODEL,
+    small_base_url=DEFAULT_SMALL_BASE_URL,
+    small_model=DEFAULT_SMALL_MODEL
+):
+    """
+    Route a prompt to the small, fast model or the large one.
+    
+    Short opening prompts without code go to the small model; code, long
+    prompts and ongoing conversations stay on the large model.
     
-    return messages
+    Args:
+        user_prompt (str): The user prompt about to be sent
+        chat_history (list): Previous message dicts of the conversation
+        base_url (str): Base URL of the large model's endpoint
+        model (str): Large model identifier
+        small_base_url (str): Base URL of the small model's endpoint
+        small_model (str): Small model identifier
+        
+    Returns:
+        tuple: (base_url, model) to query
+    """
+    tokens = len(user_prompt) // 4  # Rough token estimate
+    if "```" in user_prompt or tokens > 512:
+        return base_url, model
+    if tokens < 64 and len(chat_history) < 2:
+        return small_base_url, small_model
+    return base_url, model
 
-def on_submit(
+async def on_submit(
     user_message, 
     chat_history, 
+    messages, 
     base_url, 
     model, 
     system_prompt, 
     temperature, 
-    max_tokens
+    max_tokens,
+    auto_route=False,
+    small_base_url=DEFAULT_SMALL_BASE_URL,
+    small_model=DEFAULT_SMALL_MODEL,
+    stop_sequences=None
 ):
-    """Process user message and get response from the LLM."""
+    """
+    Process user message and stream the response from the LLM into the chat.
+    
+    The API-shaped conversation is kept in its own state and only ever appended
+    to, so every request repeats the previous one byte for byte as its prefix.
+    The last item of each update clears the cached chat export.
+    """
     if not user_message.strip():
-        return "", chat_history, None
+        yield "", chat_history, messages, None, None
+        return
     
-    # Add user message to chat history
-    chat_history = chat_history + [("User", user_message)]
+    # Add user message to chat history and show it right away
+    chat_history.append({"role": "user", "content": user_message})
+    yield "", chat_history, messages, None, None
     
-    # Extract messages for API call
-    messages = extract_message_content(chat_history)
+    # The UI holds stop sequences as JSON; None means use the defaults
+    stop = None
+    if stop_sequences is not None:
+        stop = parse_stop_sequences(stop_sequences)
+        if stop is None:
+            chat_history.append({"role": "assistant", "content": "⚠️ Stop sequences must be a JSON list of strings."})
+            yield "", chat_history, messages, None, None
+            return
     
-    # Call the API
-    success, response = query_llm(
+    # Send simple prompts to the small model when auto-routing is on
+    summary_base_url, summary_model = base_url, model
+    if auto_route:
+        summary_base_url, summary_model = small_base_url, small_model
+        base_url, model = pick_model(
+            user_message, messages, base_url, model, small_base_url, small_model
+        )
+    
+    # Fold the oldest turns into a summary once the history grows too long,
+    # using the small model when routing is enabled. The untrimmed history is
+    # kept so a failed request leaves the conversation as it was.
+    history = messages
+    messages = await _trim_history(
+        history + [{"role": "user", "content": user_message}],
+        base_url=summary_base_url,
+        model=summary_model
+    )
+    
+    # Call the API with the whole conversation, streaming partial responses into
+    # a single assistant message so each update only carries the new text
+    reply = {"role": "assistant", "content": ""}
+    chat_history.append(reply)
+    assistant_response = None
+    async for success, response in query_llm(
         user_prompt=user_message,
         base_url=base_url,
         model=model,
         system_prompt=system_prompt,
         temperature=temperature,
         max_tokens=max_tokens,
-        chat_history=messages[:-1]  # Exclude the last message as it's sent separately
-    )
+        chat_history=messages,
+        stop=stop
+    ):
+        if not success:
+            # Handle error case
+            reply["content"] = f"⚠️ {response}"
+            yield "", chat_history, history, None, None  # Without the unanswered user turn
+            return
+        assistant_response = response
+        reply["content"] = assistant_response
+        yield "", chat_history, messages, assistant_response, None
     
-    # Process the response
-    assistant_response = None
-    if success:
-        try:
-            assistant_response = response["choices"][0]["message"]["content"]
-            chat_history = chat_history + [("Assistant", assistant_response)]
-        except (KeyError, IndexError) as e:
-            error_msg = f"Error parsing API response: {str(e)}\nResponse: {json.dumps(response, indent=2)}"
-            chat_history = chat_history + [("System", f"⚠️ {error_msg}")]
-    else:
-        # Handle error case
-        chat_history = chat_history + [("System", f"⚠️ {response}")]
-    
-    return "", chat_history, assistant_response
+    # Record the completed turn for the next request
+    messages.append({"role": "assistant", "content": assistant_response})
+    yield "", chat_history, messages, assistant_response, None
 
 def format_chat_history(chat_history):
     """Format chat history for display."""
-    formatted = []
-    for sender, message in chat_history:
-        formatted.append(f"## {sender}\n\n{message}\n")
-    
-    return "\n".join(formatted)
+    return "\n".join(f"## {msg['role'].capitalize()}\n\n{msg['content']}\n" for msg in chat_history)
+
+async def export_chat_history(chat_history, cached_export):
+    """Format chat history for export, reusing the cached result while the chat is unchanged."""
+    if cached_export is None:
+        # Format long chats off the event loop so streaming replies aren't stalled
+        cached_export = await asyncio.to_thread(format_chat_history, chat_history)
+    return cached_export, cached_export
 
 def create_gradio_interface():
     """Create and launch the Gradio interface for the LLM chat application."""
+    # Imported here so using query_llm without the UI doesn't pay for loading Gradio
+    import gradio as gr
     
-    # Custom CSS for styling
-    css = """
-    .container { max-width: 1200px; margin: auto; }
-    .message pre { background-color: #f6f8fa; padding: 10px; border-radius: 4px; overflow-x: auto; }
-    .message code { font-family: monospace; background-color: #f6f8fa; padding: 2px 4px; border-radius: 3px; }
-    .markdown-area { border: 1px solid #ddd; border-radius: 4px; padding: 10px; }
-    """
-    
-    with gr.Blocks(css=css, title="LLM Chat Application") as demo:
+    with gr.Blocks(css=_CSS, title="LLM Chat Application") as demo:
         gr.Markdown("# LLM Chat Application")
         
         # State variables
         last_response = gr.State(None)
+        messages = gr.State([])  # API-shaped conversation, appended to each turn
+        cached_export = gr.State(None)  # Formatted chat history, cleared by on_submit and Clear Chat
         
         with gr.Row():
             # Left column: Chat interface
             with gr.Column(scale=2):
                 chatbot = gr.Chatbot(
+                    type="messages",
                     label="Chat",
                     height=500,
                     render_markdown=True,
@@ -250,6 +701,23 @@ def create_gradio_interface():
                         placeholder="Enter model identifier",
                         value=DEFAULT_MODEL,
                     )
+                    
+                    auto_route = gr.Checkbox(
+                        label="Auto-route simple prompts to the small model",
+                        value=False,  # Requires a second endpoint serving the small model
+                    )
+                    
+                    small_base_url = gr.Textbox(
+                        label="Small Model API Base URL",
+                        placeholder="Enter small model API base URL",
+                        value=DEFAULT_SMALL_BASE_URL,
+                    )
+                    
+                    small_model = gr.Textbox(
+                        label="Small Model",
+                        placeholder="Enter small model identifier",
+                        value=DEFAULT_SMALL_MODEL,
+                    )
                 
                 with gr.Group():
                     gr.Markdown("## Model Parameters")
@@ -274,6 +742,13 @@ def create_gradio_interface():
                         value=DEFAULT_MAX_TOKENS,
                         precision=0,
                     )
+                    
+                    with gr.Accordion("Advanced", open=False):
+                        stop_sequences = gr.Textbox(
+                            label="Stop Sequences (JSON list)",
+                            placeholder="Leave empty for no stop sequences",
+                            value=orjson.dumps(DEFAULT_STOP).decode(),
+                        )
         
         # Last response display area for copying in markdown format
         with gr.Accordion("Last Response (Markdown)", open=True):
@@ -302,10 +777,11 @@ def create_gradio_interface():
         submit_btn.click(
             on_submit,
             inputs=[
-                user_input, chatbot, base_url, model, 
-                system_prompt, temperature, max_tokens
+                user_input, chatbot, messages, base_url, model, 
+                system_prompt, temperature, max_tokens,
+                auto_route, small_base_url, small_model, stop_sequences
             ],
-            outputs=[user_input, chatbot, last_response],
+            outputs=[user_input, chatbot, messages, last_response, cached_export],
         ).then(
             lambda resp: resp if resp else "No response yet",
             inputs=[last_response],
@@ -315,10 +791,11 @@ def create_gradio_interface():
         user_input.submit(
             on_submit,
             inputs=[
-                user_input, chatbot, base_url, model, 
-                system_prompt, temperature, max_tokens
+                user_input, chatbot, messages, base_url, model, 
+                system_prompt, temperature, max_tokens,
+                auto_route, small_base_url, small_model, stop_sequences
             ],
-            outputs=[user_input, chatbot, last_response],
+            outputs=[user_input, chatbot, messages, last_response, cached_export],
         ).then(
             lambda resp: resp if resp else "No response yet",
             inputs=[last_response],
@@ -326,8 +803,8 @@ def create_gradio_interface():
         )
         
         clear_btn.click(
-            lambda: ("", [], None),
-            outputs=[user_input, chatbot, last_response],
+            lambda: ("", [], [], None, None),
+            outputs=[user_input, chatbot, messages, last_response, cached_export],
         ).then(
             lambda: "No response yet",
             outputs=[response_textbox],
@@ -338,9 +815,9 @@ def create_gradio_interface():
         
         # Export chat history
         export_btn.click(
-            format_chat_history,
-            inputs=[chatbot],
-            outputs=[chat_history_textbox],
+            export_chat_history,
+            inputs=[chatbot, cached_export],
+            outputs=[chat_history_textbox, cached_export],
         )
         
         # Copy functionality using Gradio's built-in clipboard feature
@@ -355,4 +832,5 @@ def create_gradio_interface():
 # Main application
 if __name__ == "__main__":
     demo = create_gradio_interface()
+    demo.queue(default_concurrency_limit=16, max_size=128)  # Serve several users at once
     demo.launch(share=False)
@@ -1,12 +1,196 @@
 # A modern Gradio-based LLM chat application with all the requested features. Transform a simple API querying script into a fully-featured web application.
-import gradio as gr
-import requests
-import json
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import httpx
+import orjson
+import os
 import time
+from typing import Final
+
+MAX_RETRIES = 3
+RETRY_BACKOFF_FACTOR = 0.5  # seconds, doubled on each retry
+RETRY_MAX_DELAY = 30  # seconds; longer Retry-After values are capped
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("LLM_MAX_CONCURRENCY", "32"))
+MAX_REQUESTS_PER_MINUTE = int(os.environ.get("LLM_MAX_RPM", "500"))
+DEFAULT_MAX_TOKENS = 1024
+DEFAULT_STOP = ["\nUser:", "\nSystem:"]  # Cut off runaway generations that start a new turn
+
+# Default values
+DEFAULT_SYSTEM_PROMPT: Final[str] = "You are a helpful, knowledgeable, and precise assistant. Provide accurate, factual, and concise responses."
+DEFAULT_USER_PROMPT: Final[str] = "Hello! Can you help me with a question?"
+
+# Custom CSS for styling
+_STYLE_HTML: Final[str] = """
+<style>
+    .container { max-width: 1200px; margin: 0 auto; padding: 20px; }
+    .output-box { height: 500px; overflow-y: auto; border: 1px solid #ddd; border-radius: 8px; padding: 15px; background-color: #f9f9f9; }
+    .input-box { border: 1px solid #ddd; border-radius: 8px; }
+    .feedback { color: green; font-size: 0.8em; margin-left: 10px; }
+    .copy-btn { margin-top: 5px; }
+
+    /* Custom code block styling in markdown output */
+    .output-box pre { background-color: #f0f0f0; padding: 10px; border-radius: 5px; overflow-x: auto; }
+    .output-box code { font-family: 'Courier New', monospace; }
+
+    /* Add some spacing between elements */
+    .gradio-container .prose { margin-bottom: 1rem; }
+
+    /* Make the interface more modern */
+    .gradio-container button.primary { background-color: #4f46e5; }
+    .gradio-container button.secondary { background-color: #e5e7eb; color: #111827; }
+</style>
+"""
+
+# Copies the clicked button's input to the clipboard in the browser, then passes it on to copy_text
+_COPY_JS: Final[str] = """
+(text) => {
+    // Copy through a temporary textarea element
+    const textarea = document.createElement('textarea');
+    textarea.value = text;
+    textarea.setAttribute('readonly', '');
+    textarea.style.position = 'absolute';
+    textarea.style.left = '-9999px';
+    document.body.appendChild(textarea);
+    textarea.select();
+    document.execCommand('copy');
+    document.body.removeChild(textarea);
+    return text;
+}
+"""
+
+# Header
+_HEADER_HTML: Final[str] = """
+<div style="text-align: center; margin-bottom: 20px;">
+    <h1 style="margin-bottom: 5px;">LLM Chat Application</h1>
+    <p>Interact with AI models through a user-friendly interface</p>
+</div>
+"""
+
+# Instructions accordion
+_INSTRUCTIONS_MD: Final[str] = """
+## How to Use This Application
+
+This chat application allows you to interact with Large Language Models through a local or remote API.
+
+### Quick Start:
+
+1. **Configure the API**:
+   - Enter the API endpoint (e.g., `http://localhost:11434/v1/chat/completions`)
+   - Specify the model name (e.g., `phi4-mini:3.8b-q4_K_M`)
+
+2. **Set Parameters**:
+   - Adjust temperature (0-1): Lower values make responses more deterministic, higher values more creative
+   - Set max tokens (1-4096): Controls the maximum response length
+
+3. **Enter Prompts**:
+   - **System Prompt**: Instructions for the AI's behavior and context
+   - **User Prompt**: Your specific question or request
+
+4. **Submit and Review**:
+   - Click Submit to send the query
+   - Review the response in the output box
+   - Use copy buttons to save prompts or responses
+
+### Example Prompts:
+
+**System Prompt Example:**
+```
+You are a helpful, knowledgeable assistant with expertise in science and technology. 
+Provide accurate, factual responses with examples where appropriate.
+```
+
+**User Prompt Example:**
+```
+Can you explain how nuclear fusion works and why it's difficult to achieve on Earth?
+```
+"""
+
+# Shared async client so concurrent users overlap on one event loop over pooled HTTP/2 connections
+_ACLIENT = httpx.AsyncClient(
+    timeout=httpx.Timeout(30.0, connect=5.0),
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=MAX_RETRIES,  # Retry failed connection attempts
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    ),
+)
+
+class RateLimiter:
+    """Token bucket that allows up to rpm requests per minute."""
+    
+    def __init__(self, rpm=500):
+        self.rate = rpm / 60.0  # Tokens added per second
+        self.capacity = float(rpm)
+        self.tokens = float(rpm)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """Wait until a request may be sent, then take its token."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# Client-side limits so concurrent users don't pile onto the backend
+_SEM = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+_LIMITER = RateLimiter(rpm=MAX_REQUESTS_PER_MINUTE)
+
+@contextlib.asynccontextmanager
+async def _post_stream(url, headers, body):
+    """
+    Open a streaming POST, retrying transient error statuses with exponential backoff.
+    
+    At most MAX_CONCURRENT_REQUESTS are in flight at once, and every attempt
+    counts against the MAX_REQUESTS_PER_MINUTE budget. The concurrency slot is
+    released while waiting between attempts.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        async with _SEM:
+            await _LIMITER.acquire()
+            async with _ACLIENT.stream("POST", url, headers=headers, content=body) as response:
+                if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    yield response
+                    return
+                retry_after = response.headers.get("Retry-After", "")
+        # Honour the server's Retry-After when given, otherwise back off exponentially
+        if retry_after.isdigit():
+            delay = min(float(retry_after), RETRY_MAX_DELAY)
+        else:
+            delay = RETRY_BACKOFF_FACTOR * 2 ** attempt
+        await asyncio.sleep(delay)
+
+def parse_stop_sequences(stop_text):
+    """
+    Parse stop sequences entered in the UI as a JSON list of strings.
+    
+    Args:
+        stop_text (str): JSON list such as ["\\nUser:"]; empty for no stop sequences
+        
+    Returns:
+        list or None: The stop sequences, or None if the text is not a list of strings
+    """
+    if not stop_text or not stop_text.strip():
+        return []
+    try:
+        stop = orjson.loads(stop_text)
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(stop, list) or not all(isinstance(seq, str) for seq in stop):
+        return None
+    return stop
 
-def query_llm(base_url, model, system_prompt, user_prompt, temperature=0.7, max_tokens=2048):
+async def query_llm(base_url, model, system_prompt, user_prompt, temperature=0.7, max_tokens=DEFAULT_MAX_TOKENS, stop=None):
     """
-    Query the LLM API with the given parameters.
+    Query the LLM API with the given parameters, streaming the response.
     
     Args:
         base_url (str): The base URL of the API endpoint
@@ -15,35 +199,40 @@ def query_llm(base_url, model, system_prompt, user_prompt, temperature=0.7, max_
         user_prompt (str): The user prompt
         temperature (float): The temperature parameter (0.0-1.0)
         max_tokens (int): Maximum number of tokens to generate
+        stop (list, optional): Stop sequences; defaults to DEFAULT_STOP
         
-    Returns:
-        str: The API response content or error message
+    Yields:
+        str: The response content received so far, or an error message
     """
     try:
         # Input validation
         if not base_url:
-            return "**Error:** API endpoint URL cannot be empty."
+            yield "**Error:** API endpoint URL cannot be empty."
+            return
         if not model:
-            return "**Error:** Model name cannot be empty."
+            yield "**Error:** Model name cannot be empty."
+            return
         
-        # Validate temperature range
-        try:
-            temperature = float(temperature)
-            if not 0.0 <= temperature <= 1.0:
-                return "**Error:** Temperature must be between 0.0 and 1.0."
-        except ValueError:
-            return "**Error:** Temperature must be a valid number between 0.0 and 1.0."
+        # Validate temperature range (the slider already supplies a number)
+        if not isinstance(temperature, (int, float)):
+            yield "**Error:** Temperature must be a valid number between 0.0 and 1.0."
+            return
+        if not 0.0 <= temperature <= 1.0:
+            yield "**Error:** Temperature must be between 0.0 and 1.0."
+            return
         
-        # Validate max_tokens
-        try:
-            max_tokens = int(max_tokens)
-            if max_tokens < 1:
-                return "**Error:** Max tokens must be at least 1."
-        except ValueError:
-            return "**Error:** Max tokens must be a valid integer."
+        # Validate max_tokens (the number field may supply a float)
+        if not isinstance(max_tokens, (int, float)):
+            yield "**Error:** Max tokens must be a valid integer."
+            return
+        if max_tokens < 1:
+            yield "**Error:** Max tokens must be at least 1."
+            return
+        max_tokens = int(max_tokens)
         
         headers = {
-            "Content-Type": "application/json"
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream"
         }
         
         payload = {
@@ -53,97 +242,75 @@ def query_llm(base_url, model, system_prompt, user_prompt, temperature=0.7, max_
                 {"role": "user", "content": user_prompt}
             ],
             "temperature": temperature,
-            "max_tokens": max_tokens
+            "max_tokens": max_tokens,
+            "stream": True
         }
+        if stop is None:
+            stop = DEFAULT_STOP
+        if stop:
+            payload["stop"] = stop
         
-        response = requests.post(
-            base_url,
-            headers=headers,
-            data=json.dumps(payload),
-            timeout=30  # Add timeout for robustness
-        )
-        
-        response.raise_for_status()  # Raise exception for bad status codes
-        result = response.json()
-        
-        # Extract the assistant's message from the response
-        if "choices" in result and len(result["choices"]) > 0:
-            if "message" in result["choices"][0]:
-                return result["choices"][0]["message"]["content"]
-            else:
-                return "**Error:** Unexpected API response format. Missing 'message' field."
-        else:
-            return "**Error:** Unexpected API response format. Missing 'choices' field."
+        async with _post_stream(base_url, headers, orjson.dumps(payload)) as response:
+            if response.is_error:
+                await response.aread()
+            response.raise_for_status()  # Raise exception for bad status codes
+            
+            if not response.headers.get("Content-Type", "").startswith("text/event-stream"):
+                # The server ignored "stream" and sent the whole completion at once
+                await response.aread()
+                result = orjson.loads(response.content)
+                
+                # Extract the assistant's message from the response
+                if "choices" in result and len(result["choices"]) > 0:
+                    if "message" in result["choices"][0]:
+                        yield result["choices"][0]["message"]["content"]
+                    else:
+                        yield "**Error:** Unexpected API response format. Missing 'message' field."
+                else:
+                    yield "**Error:** Unexpected API response format. Missing 'choices' field."
+                return
+            
+            # Accumulate the assistant's message from the streamed deltas
+            content = ""
+            async for line in response.aiter_lines():
+                if not line or not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    break
+                chunk = orjson.loads(data)
+                if "choices" not in chunk:
+                    yield "**Error:** Unexpected API response format. Missing 'choices' field."
+                    return
+                if not chunk["choices"]:
+                    continue
+                delta = chunk["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    content += delta
+                    yield content
+            yield content
     
-    except requests.exceptions.RequestException as e:
-        return f"**Error:** API request failed: {str(e)}"
-    except json.JSONDecodeError:
-        return "**Error:** Failed to parse API response as JSON."
+    except httpx.HTTPError as e:
+        yield f"**Error:** API request failed: {str(e)}"
+    except orjson.JSONDecodeError:
+        yield "**Error:** Failed to parse API response as JSON."
     except Exception as e:
-        return f"**Error:** An unexpected error occurred: {str(e)}"
+        yield f"**Error:** An unexpected error occurred: {str(e)}"
 
 def create_llm_chat_app():
     """
     Creates a Gradio-based web UI for the LLM chat application.
     """
-    # Default values
-    DEFAULT_SYSTEM_PROMPT = "You are a helpful, knowledgeable, and precise assistant. Provide accurate, factual, and concise responses."
-    DEFAULT_USER_PROMPT = "Hello! Can you help me with a question?"
+    # Imported here so using query_llm without the UI doesn't pay for loading Gradio
+    import gradio as gr
     
     # Create Gradio interface
     with gr.Blocks(theme=gr.themes.Soft()) as demo:
         # Custom CSS for styling
-        gr.HTML("""
-        <style>
-            .container { max-width: 1200px; margin: 0 auto; padding: 20px; }
-            .output-box { height: 500px; overflow-y: auto; border: 1px solid #ddd; border-radius: 8px; padding: 15px; background-color: #f9f9f9; }
-            .input-box { border: 1px solid #ddd; border-radius: 8px; }
-            .feedback { color: green; font-size: 0.8em; margin-left: 10px; }
-            .copy-btn { margin-top: 5px; }
-            
-            /* Custom code block styling in markdown output */
-            .output-box pre { background-color: #f0f0f0; padding: 10px; border-radius: 5px; overflow-x: auto; }
-            .output-box code { font-family: 'Courier New', monospace; }
-            
-            /* Add some spacing between elements */
-            .gradio-container .prose { margin-bottom: 1rem; }
-            
-            /* Make the interface more modern */
-            .gradio-container button.primary { background-color: #4f46e5; }
-            .gradio-container button.secondary { background-color: #e5e7eb; color: #111827; }
-        </style>
-        
-        <script>
-        // Function to copy text to clipboard
-        function copyTextToClipboard(text) {
-            // Create a temporary textarea element
-            const textarea = document.createElement('textarea');
-            textarea.value = text;
-            textarea.setAttribute('readonly', '');
-            textarea.style.position = 'absolute';
-            textarea.style.left = '-9999px';
-            document.body.appendChild(textarea);
-            
-            // Select and copy the text
-            textarea.select();
-            document.execCommand('copy');
-            
-            // Clean up
-            document.body.removeChild(textarea);
-            
-            // Return a message for user feedback
-            return "Copied!";
-        }
-        </script>
-        """)
+        gr.HTML(_STYLE_HTML)
         
         # Header
-        gr.HTML("""
-        <div style="text-align: center; margin-bottom: 20px;">
-            <h1 style="margin-bottom: 5px;">LLM Chat Application</h1>
-            <p>Interact with AI models through a user-friendly interface</p>
-        </div>
-        """)
+        gr.HTML(_HEADER_HTML)
         
         # API Configuration section
         with gr.Accordion("API Configuration", open=True):
@@ -172,12 +339,20 @@ def create_llm_chat_app():
                 )
                 max_tokens = gr.Number(
                     label="Max Tokens",
-                    value=2048,
+                    value=DEFAULT_MAX_TOKENS,
                     minimum=1,
                     maximum=4096,
                     step=1,
                     info="Maximum response length"
                 )
+            
+            with gr.Accordion("Advanced", open=False):
+                stop_sequences = gr.Textbox(
+                    label="Stop Sequences",
+                    value=orjson.dumps(DEFAULT_STOP).decode(),
+                    placeholder="JSON list of strings; leave empty for no stop sequences",
+                    lines=1
+                )
         
         # Prompt inputs
         with gr.Group():
@@ -268,31 +443,39 @@ def create_llm_chat_app():
             fn=copy_text,
             inputs=[system_prompt],
             outputs=[system_copy_feedback],
-            _js="copyTextToClipboard"
+            js=_COPY_JS
         )
         
         user_copy_btn.click(
             fn=copy_text,
             inputs=[user_prompt],
             outputs=[user_copy_feedback],
-            _js="copyTextToClipboard"
+            js=_COPY_JS
         )
         
         response_copy_btn.click(
             fn=copy_text,
             inputs=[raw_response],
             outputs=[response_copy_feedback],
-            _js="copyTextToClipboard"
+            js=_COPY_JS
         )
         
         # Submit function with progress handling
-        def submit_query(base_url, model, system_prompt, user_prompt, temperature, max_tokens):
+        async def submit_query(base_url, model, system_prompt, user_prompt, temperature, max_tokens, stop_sequences):
             # Update status immediately
             yield "Querying the LLM...", "", ""
             
+            stop = parse_stop_sequences(stop_sequences)
+            if stop is None:
+                error_message = "**Error:** Stop sequences must be a JSON list of strings."
+                yield "Error: invalid stop sequences", error_message, error_message
+                return
+            
             try:
-                # Call the API
-                response = query_llm(base_url, model, system_prompt, user_prompt, temperature, max_tokens)
+                # Call the API, streaming partial responses into the output
+                response = ""
+                async for response in query_llm(base_url, model, system_prompt, user_prompt, temperature, max_tokens, stop):
+                    yield "Receiving response...", response, response
                 
                 # Store the raw response for clipboard
                 yield "Query complete!", response, response
@@ -303,53 +486,18 @@ def create_llm_chat_app():
         # Connect the submit button to the query function
         submit_btn.click(
             fn=submit_query,
-            inputs=[base_url, model, system_prompt, user_prompt, temperature, max_tokens],
+            inputs=[base_url, model, system_prompt, user_prompt, temperature, max_tokens, stop_sequences],
             outputs=[status, output, raw_response]
         )
         
         # Instructions accordion
         with gr.Accordion("Instructions & Examples", open=False):
-            gr.Markdown("""
-            ## How to Use This Application
-            
-            This chat application allows you to interact with Large Language Models through a local or remote API.
-            
-            ### Quick Start:
-            
-            1. **Configure the API**:
-               - Enter the API endpoint (e.g., `http://localhost:11434/v1/chat/completions`)
-               - Specify the model name (e.g., `phi4-mini:3.8b-q4_K_M`)
-            
-            2. **Set Parameters**:
-               - Adjust temperature (0-1): Lower values make responses more deterministic, higher values more creative
-               - Set max tokens (1-4096): Controls the maximum response length
-            
-            3. **Enter Prompts**:
-               - **System Prompt**: Instructions for the AI's behavior and context
-               - **User Prompt**: Your specific question or request
-            
-            4. **Submit and Review**:
-               - Click Submit to send the query
-               - Review the response in the output box
-               - Use copy buttons to save prompts or responses
-            
-            ### Example Prompts:
-            
-            **System Prompt Example:**
-            ```
-            You are a helpful, knowledgeable assistant with expertise in science and technology. 
-            Provide accurate, factual responses with examples where appropriate.
-            ```
-            
-            **User Prompt Example:**
-            ```
-            Can you explain how nuclear fusion works and why it's difficult to achieve on Earth?
-            ```
-            """)
+            gr.Markdown(_INSTRUCTIONS_MD)
     
     return demo
 
 # Create and launch the app
 if __name__ == "__main__":
     app = create_llm_chat_app()
+    app.queue(default_concurrency_limit=16, max_size=128)  # Serve several users at once
     app.launch()